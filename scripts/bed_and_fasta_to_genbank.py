@@ -7,13 +7,19 @@ Goal:
 
 This code was made for centromeric annotations. Please modify the features as required.
 It can optionally extract a specific genomic region (e.g. chrI:3677528-3877528).
+The FASTA (plain or bgzip-compressed) is read through a faidx index (genome.fasta.fai),
+which is created if missing; without a usable index the whole FASTA is parsed instead.
 
 Usage:
     python bed_and_fasta_to_genbank.py genome.fasta annotations.bed output.gb [chr:start-end]
 """
 
 from Bio import SeqIO
-from Bio.SeqFeature import SeqFeature, FeatureLocation
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from pyfaidx import Fasta, FastaIndexingError
+import numpy as np
+import pandas as pd
 import sys
 import re
 
@@ -30,95 +36,230 @@ FEATURE_TYPE_MAP = {
     "imr_chr3": "centromere",
 }
 
+STRAND_MAP = {"+": 1, "-": -1}
+
+REGION_RE = re.compile(r"^(\S+):(\d+)-(\d+)$")
+
+BED_COLUMNS = ["chrom", "start", "end", "label", "score", "strand", "tRNA_type", "tRNA_seq", "gene_name"]
+
+# GenBank feature table layout, as written by Biopython
+FEATURES_HEADER = "FEATURES             Location/Qualifiers\n"
+QUALIFIER_INDENT = 21
+QUALIFIER_PAD = " " * QUALIFIER_INDENT
+MAX_WIDTH = 80
+
 
 def parse_region(region_str):
     """Parse a region string like 'chrI:3677528-3877528'."""
-    m = re.match(r"^(\S+):(\d+)-(\d+)$", region_str)
+    m = REGION_RE.match(region_str)
     if not m:
         sys.exit(f"Invalid region format: {region_str} (expected chr:start-end)")
     chrom, start, end = m.groups()
     return chrom, int(start), int(end)
 
 
+def format_location(start, end, strand, rec_length):
+    """Format a 0-based half-open interval as a GenBank location string."""
+    if start == end:
+        loc = f"{rec_length}^1" if end == rec_length else f"{end}^{end + 1}"
+    elif start + 1 == end:
+        loc = f"{end}"
+    else:
+        loc = f"{start + 1}..{end}"
+    return f"complement({loc})" if strand == -1 else loc
+
+
+def format_qualifier(key, value):
+    """Format a /key="value" qualifier, wrapping long values at spaces like Biopython."""
+    value = value.replace('"', '""')
+    line = f'{QUALIFIER_PAD}/{key}="{value}"'
+    lines = []
+    while len(line) > MAX_WIDTH:
+        index = line.rfind(" ", QUALIFIER_INDENT + 2, MAX_WIDTH + 1)
+        if index == -1:
+            index = MAX_WIDTH
+        lines.append(line[:index])
+        line = QUALIFIER_PAD + line[index:].lstrip()
+    if line.strip():
+        lines.append(line)
+    return "".join(f"{line}\n" for line in lines)
+
+
+def format_feature(ftype, start, end, strand, qualifiers, rec_length):
+    """Format one entry of the GenBank FEATURES table."""
+    text = f"     {ftype:<16}"[:QUALIFIER_INDENT] + format_location(start, end, strand, rec_length) + "\n"
+    for key, value in qualifiers.items():
+        text += format_qualifier(key, value)
+    return text
+
+
+class FeatureSplicingHandle:
+    """
+    Output handle wrapper that inserts pre-formatted feature entries right after
+    the FEATURES header Biopython writes, passing everything else straight through.
+    """
+
+    def __init__(self, handle, features):
+        self.handle = handle
+        self.features = features
+        self.spliced = False
+
+    def write(self, text):
+        if self.spliced or FEATURES_HEADER not in text:
+            self.handle.write(text)
+            return
+        # The header may arrive on its own or inside a larger chunk
+        before, header, after = text.partition(FEATURES_HEADER)
+        self.handle.write(before + header)
+        self.handle.writelines(self.features)
+        self.handle.write(after)
+        self.spliced = True
+
+
+def write_genbank_record(handle, record, features):
+    """
+    Stream a featureless record to handle with Biopython, with the pre-formatted
+    feature entries spliced in after its FEATURES header.
+    """
+    splicer = FeatureSplicingHandle(handle, features)
+    SeqIO.write([record], splicer, "genbank")
+    if not splicer.spliced:
+        raise RuntimeError(f"No FEATURES header written for {record.id}; features could not be inserted")
+
+
+def open_genome(fasta_file):
+    """
+    Open the FASTA for random access through its faidx index. If the index can
+    neither be read nor built (e.g. read-only directory, irregular line lengths),
+    fall back to parsing the whole FASTA with Biopython.
+    Returns:
+        (contig -> length, contig -> FASTA header, fetch(contig, start, end) -> str)
+    """
+    try:
+        genome = Fasta(fasta_file, as_raw=True)
+    except (OSError, FastaIndexingError) as err:
+        sys.stderr.write(f"Warning: no usable index for {fasta_file} ({err}); parsing the whole FASTA.\n")
+        records = SeqIO.to_dict(SeqIO.parse(fasta_file, "fasta"))
+        contig_lengths = {chrom: len(rec) for chrom, rec in records.items()}
+        headers = {chrom: rec.description for chrom, rec in records.items()}
+        return contig_lengths, headers, lambda chrom, start, end: str(records[chrom].seq[start:end])
+
+    contig_lengths = {chrom: len(genome[chrom]) for chrom in genome.keys()}
+    headers = {chrom: genome[chrom].long_name for chrom in genome.keys()}
+    return contig_lengths, headers, lambda chrom, start, end: genome[chrom][start:end]
+
+
 def bed_to_genbank(fasta_file, bed_file, output_file, region=None):
-    # Load all contigs
-    records = SeqIO.to_dict(SeqIO.parse(fasta_file, "fasta"))
-    for rec in records.values():
-        rec.annotations["molecule_type"] = "DNA"
-        rec.features = []
+    # Index the FASTA; sequences are only read when a record is written
+    contig_lengths, headers, fetch = open_genome(fasta_file)
+    features = {chrom: [] for chrom in contig_lengths}
 
     # If a region was provided, parse it
     if region:
         region_chr, region_start, region_end = parse_region(region)
-        if region_chr not in records:
+        if region_chr not in contig_lengths:
             sys.exit(f"Contig {region_chr} not found in FASTA file.")
         region_mode = True
+        # Clamp the region to the contig, as slicing a sequence would
+        slice_start, slice_end, _ = slice(region_start, region_end).indices(contig_lengths[region_chr])
     else:
         region_mode = False
 
     # Parse BED file
     with open(bed_file) as bed:
-        header = bed.readline().strip().split()
-        if not header[0].lower().startswith("chrom"):
+        # Only the first field is needed to spot a header line
+        header = bed.readline().split(None, 1)
+        if not header or not header[0].lower().startswith("chrom"):
             bed.seek(0)
 
-        for line in bed:
-            if not line.strip() or line.startswith("#"):
-                continue
-            parts = line.strip().split("\t")
-            if len(parts) < 6:
-                sys.stderr.write(f"Skipping malformed line: {line}")
-                continue
+        lines = pd.Series(bed.read().split("\n"), dtype=object)
 
-            chrom, start, end, label = parts[0:4]
-            strand = parts[5] if len(parts) > 5 else "+"
-            tRNA_type = parts[6] if len(parts) > 6 else "None"
-            tRNA_seq = parts[7] if len(parts) > 7 else "None"
-            gene_name = parts[8] if len(parts) > 8 else "None"
+    # Skip blank and '#' lines; the rest are stripped and split on tabs, so the
+    # field count of each line decides which optional columns it actually has
+    lines = lines[(lines.str.strip() != "") & ~lines.str.startswith("#")]
+    stripped = lines.str.strip()
+    n_fields = stripped.str.count("\t") + 1
 
-            if chrom not in records:
-                sys.stderr.write(f"Warning: contig '{chrom}' not in FASTA; skipping.\n")
+    # Lines with fewer than 6 columns have no strand
+    malformed = n_fields < 6
+    for line in lines[malformed]:
+        sys.stderr.write(f"Skipping malformed line: {line}\n")
+    stripped, n_fields = stripped[~malformed], n_fields[~malformed]
+
+    # Columns past the ninth are ignored
+    bed_df = stripped.str.split("\t", n=len(BED_COLUMNS), expand=True)
+    bed_df = bed_df.reindex(columns=range(len(BED_COLUMNS)))
+    bed_df.columns = BED_COLUMNS
+    for position, col in enumerate(BED_COLUMNS[6:], start=6):
+        bed_df[col] = bed_df[col].where(n_fields > position, "None")
+
+    bed_df["start"] = bed_df["start"].astype(np.int64)
+    bed_df["end"] = bed_df["end"].astype(np.int64)
+    bed_df["ftype"] = bed_df["label"].map(FEATURE_TYPE_MAP).fillna("misc_feature")
+
+    bed_df = bed_df[["chrom", "start", "end", "label", "strand", "tRNA_type", "tRNA_seq", "gene_name", "ftype"]]
+    # Local names for the lookups done on every BED row
+    strand_map = STRAND_MAP.get
+    contig_length = contig_lengths.get
+    for chrom, start, end, label, strand, tRNA_type, tRNA_seq, gene_name, ftype in bed_df.itertuples(index=False):
+        rec_length = contig_length(chrom)
+        if rec_length is None:
+            sys.stderr.write(f"Warning: contig '{chrom}' not in FASTA; skipping.\n")
+            continue
+
+        # Locations are formatted as text, so check the interval the way FeatureLocation did
+        if end < start:
+            raise ValueError(f"End location ({end}) must be greater than or equal to start location ({start})")
+
+        # Anything other than "+" is written as the reverse strand
+        strand_val = strand_map(strand, -1)
+
+        # In region mode only features lying fully inside the region are kept
+        if region_mode:
+            if chrom != region_chr or start < slice_start or end > slice_end:
                 continue
+            start, end = start - slice_start, end - slice_start
+            rec_length = slice_end - slice_start
+
+        qualifiers = {"label": label}
+        if gene_name and gene_name != "None":
+            qualifiers["gene"] = gene_name
+        if label == "tRNA":
+            qualifiers["product"] = f"tRNA-{tRNA_type}({tRNA_seq})"
+        elif label == "gene" and gene_name:
+            qualifiers["note"] = f"protein-coding gene {gene_name}"
 
-            start, end = int(start), int(end)
-            strand_val = 1 if strand == "+" else -1
-            ftype = FEATURE_TYPE_MAP.get(label, "misc_feature")
-
-            # Skip features outside the region if region mode
-            if region_mode and chrom == region_chr:
-                if end < region_start or start > region_end:
-                    continue
-
-            qualifiers = {"label": label}
-            if gene_name and gene_name != "None":
-                qualifiers["gene"] = gene_name
-            if label == "tRNA":
-                qualifiers["product"] = f"tRNA-{tRNA_type}({tRNA_seq})"
-            elif label == "gene" and gene_name:
-                qualifiers["note"] = f"protein-coding gene {gene_name}"
-
-            feature = SeqFeature(
-                FeatureLocation(start, end, strand=strand_val),
-                type=ftype,
-                qualifiers=qualifiers
-            )
-            records[chrom].features.append(feature)
+        features[chrom].append(format_feature(ftype, start, end, strand_val, qualifiers, rec_length))
 
     # Handle region extraction
     if region_mode:
-        rec = records[region_chr]
-        # Extract the subsequence and overlapping features
-        sub_rec = rec[region_start:region_end]
-        sub_rec.id = f"{region_chr}_{region_start}_{region_end}"
-        sub_rec.name = f"{region_chr}_{region_start}_{region_end}"
-        sub_rec.description = f"Subsequence from {region_chr}:{region_start}-{region_end}"
-        SeqIO.write(sub_rec, output_file, "genbank")
+        # Fetch only the subsequence; its features were shifted while parsing the BED
+        sub_id = f"{region_chr}_{region_start}_{region_end}"
+        sub_rec = SeqRecord(
+            Seq(fetch(region_chr, slice_start, slice_end)),
+            id=sub_id,
+            name=sub_id,
+            description=f"Subsequence from {region_chr}:{region_start}-{region_end}",
+            annotations={"molecule_type": "DNA"}
+        )
+        with open(output_file, "w") as out:
+            write_genbank_record(out, sub_rec, features[region_chr])
         print(f"Extracted region {region_chr}:{region_start}-{region_end} -> {output_file}")
     else:
-        # Write all contigs
-        SeqIO.write(records.values(), output_file, "genbank")
+        # Write all contigs, reading one sequence at a time
+        with open(output_file, "w") as out:
+            for chrom, length in contig_lengths.items():
+                rec = SeqRecord(
+                    Seq(fetch(chrom, 0, length)),
+                    id=chrom,
+                    name=chrom,
+                    description=headers[chrom],
+                    annotations={"molecule_type": "DNA"}
+                )
+                # Drop the contig's feature entries as soon as they are written
+                write_genbank_record(out, rec, features.pop(chrom))
         print(f"GenBank written: {output_file}")
-        print(f"Contigs: {', '.join(records.keys())}")
+        print(f"Contigs: {', '.join(contig_lengths.keys())}")
 
 
 if __name__ == "__main__":
@@ -1,5 +1,12 @@
 import sys
 import argparse
+import multiprocessing
+from contextlib import nullcontext
+import numpy as np
+import pandas as pd
+from numba import njit
+
+OUTPUT_BUFFER_SIZE = 1024 * 1024
 
 def parse_fai(fai_file):
     """
@@ -7,32 +14,25 @@ def parse_fai(fai_file):
     Returns:
         dict: A dictionary mapping contig names to their lengths.
     """
-    contig_sizes = {}
-    with open(fai_file, 'r') as f:
-        for line in f:
-            if not line.strip():
-                continue  # Skip empty lines
+    fai = pd.read_csv(fai_file, sep=r"\s+", header=None, usecols=[0, 1], names=["contig", "length"],
+                      dtype=str, keep_default_na=False, na_values=[""], on_bad_lines="skip")
 
-            parts = line.strip().split()
-            if len(parts) < 2:
-                print(f"Warning: Skipping malformed line in FAI file: {line.strip()}")
-                continue
+    malformed = fai["length"].isna()
+    for contig in fai.loc[malformed, "contig"]:
+        print(f"Warning: Skipping malformed line in FAI file: {contig}")
 
-            try:
-                contig_name = parts[0]
-                contig_length = int(parts[1])
-                contig_sizes[contig_name] = contig_length
-            except ValueError:
-                print(f"Error: Invalid contig size on line: {line.strip()}")
-                continue
+    invalid = ~malformed & ~fai["length"].str.fullmatch(r"\s*[+-]?\d+\s*", na=False)
+    for contig, length in zip(fai.loc[invalid, "contig"], fai.loc[invalid, "length"]):
+        print(f"Error: Invalid contig size on line: {contig}\t{length}")
 
-    return contig_sizes
+    fai = fai[~malformed & ~invalid].astype({"length": int})
+    return fai.set_index("contig")["length"].to_dict()
 
 def parse_events(events_file):
     """
     Parse the file containing genomic events (e.g., origin positions).
     Returns:
-        dict: A dictionary mapping contigs to lists of event positions.
+        dict: A dictionary mapping contigs to sorted arrays of event positions.
     """
     events = {}
     with open(events_file, 'r') as f:
@@ -61,39 +61,76 @@ def parse_events(events_file):
             if contig not in events:
                 events[contig] = []
             events[contig].append(position)
+
+    for contig, positions in events.items():
+        events[contig] = np.sort(np.asarray(positions, dtype=np.int64))
     return events
 
-def count_events_in_window(contig, start, end, event_positions):
+@njit(cache=True)
+def count_events_in_windows(starts, ends, event_positions):
+    """
+    Count how many events fall within each genomic window [start, end).
+    Windows and event_positions must be sorted; both are walked once with two pointers.
     """
-    Count how many events fall within a specific genomic window.
+    counts = np.empty(len(starts), dtype=np.int64)
+    n_events = len(event_positions)
+    lo = 0
+    hi = 0
+    for i in range(len(starts)):
+        while hi < n_events and event_positions[hi] < ends[i]:
+            hi += 1
+        while lo < n_events and event_positions[lo] < starts[i]:
+            lo += 1
+        counts[i] = hi - lo
+    return counts
+
+def _process_contig(args):
     """
-    count = 0
-    for event in event_positions:
-        if start <= event < end:
-            count += 1
-    return count
+    Count events in every window of one contig.
+    Returns the contig's output rows and, if verbose, its per-window trace.
+    """
+    contig, size, event_positions, window_size, slide_size, verbose = args
+
+    starts = np.arange(0, size, slide_size)
+    ends = np.minimum(starts + window_size, size)
+    if not len(starts):
+        return "", ""  # Empty contig
+    event_counts = count_events_in_windows(starts, ends, event_positions)
+
+    trace = ""
+    if verbose:
+        trace = "\n".join(f"Window: {start}-{end}, Event count: {event_count}"
+                          for start, end, event_count in zip(starts, ends, event_counts)) + "\n"
 
-def sliding_window(contig_sizes, events, window_size, slide_size, output_file):
+    lines = [f"{contig}\t{start}\t{end}\t{event_count}"
+             for start, end, event_count in zip(starts, ends, event_counts)]
+    return "\n".join(lines) + "\n", trace
+
+def sliding_window(contig_sizes, events, window_size, slide_size, output_file, verbose=False, processes=None):
     """
     Perform sliding window analysis across the genome.
+    Contigs are counted in parallel by a pool of `processes` workers (default: all cores),
+    or in this process when processes is 1 or there is a single contig, and written in .fai order.
+    Per-window counts are only echoed to stdout when verbose is set.
     """
-    with open(output_file, 'w') as out:
+    items = [(contig, size, events.get(contig, np.empty(0, dtype=np.int64)), window_size, slide_size, verbose)
+             for contig, size in contig_sizes.items()]
+
+    # A pool only pays for its startup when there are several contigs to spread over workers
+    serial = processes == 1 or len(items) <= 1
+    pool_context = nullcontext() if serial else multiprocessing.Pool(processes)
+
+    with open(output_file, 'w', buffering=OUTPUT_BUFFER_SIZE) as out, pool_context as pool:
         # Write header
         out.write("contig\tstart_window\tend_window\tevent_count\n")
 
-        for contig, size in contig_sizes.items():
+        results = map(_process_contig, items) if serial else pool.imap(_process_contig, items)
+        for (contig, size, event_positions, *_), (rows, trace) in zip(items, results):
             print(f"Processing contig: {contig} of size {size}")
-
-            event_positions = events.get(contig, [])
             print(f"Found {len(event_positions)} events for contig {contig}")
+            sys.stdout.write(trace)
 
-            for start in range(0, size, slide_size):
-                end = min(start + window_size, size)
-                event_count = count_events_in_window(contig, start, end, event_positions)
-
-                print(f"Window: {start}-{end}, Event count: {event_count}")
-
-                out.write(f"{contig}\t{start}\t{end}\t{event_count}\n")
+            out.write(rows)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="""
@@ -113,6 +150,10 @@ if __name__ == "__main__":
     parser.add_argument("--slide_size", type=int, default=None,
                         help="Step size for sliding window (in bases). Defaults to window_size (no overlap).")
     parser.add_argument("output_file", help="Output file for writing the results")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Print the event count of every window to stdout.")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Number of worker processes used to count contigs. Defaults to all cores.")
 
     args = parser.parse_args()
 
@@ -124,6 +165,8 @@ if __name__ == "__main__":
     # Sanity checks
     if args.slide_size <= 0 or args.window_size <= 0:
         sys.exit("Error: Both window_size and slide_size must be positive integers.")
+    if args.processes is not None and args.processes <= 0:
+        sys.exit("Error: processes must be a positive integer.")
 
     if args.slide_size > args.window_size:
         print("Warning: slide_size is greater than window_size. Windows will be non-overlapping with gaps.")
@@ -131,4 +174,5 @@ if __name__ == "__main__":
     # Run the analysis
     contig_sizes = parse_fai(args.fai_file)
     events = parse_events(args.events_file)
-    sliding_window(contig_sizes, events, args.window_size, args.slide_size, args.output_file)
+    sliding_window(contig_sizes, events, args.window_size, args.slide_size, args.output_file,
+                   verbose=args.verbose, processes=args.processes)
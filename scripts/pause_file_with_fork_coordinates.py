@@ -10,11 +10,27 @@ Usage:
         --output_file /path/to/test_updated_pause_file.txt
 """
 
+import numpy as np
 import pandas as pd
+from numba import njit, prange
 import argparse
 import os
 
 
+# Columns filled in from the matching fork; missing values are written out as "NA"
+FORK_COLUMNS = {
+    "left_fork_start": "Int32",
+    "left_fork_end": "Int32",
+    "right_fork_start": "Int32",
+    "right_fork_end": "Int32",
+    "direction": "string",
+    "strand": "string",
+    "alignLen": "Int32",
+    "start_read": "Int32",
+    "end_read": "Int32",
+}
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Update a pause file with fork information.")
     parser.add_argument("--pause_file", required=True)
@@ -24,15 +40,28 @@ def parse_args():
     return parser.parse_args()
 
 
+def downcast_int32(df, cols, source):
+    """
+    Downcast int64 coordinate columns to int32, failing loudly on values that do not fit.
+    """
+    bounds = np.iinfo(np.int32)
+    for col in cols:
+        if len(df) and (df[col].min() < bounds.min or df[col].max() > bounds.max):
+            raise ValueError(f"{source}: {col} values exceed the int32 range")
+    return df.astype(dict.fromkeys(cols, np.int32))
+
+
 def load_fork_file(fork_file, fork_type):
     """
     Fork file columns (no header): contig fork_start fork_end read_id contig start_read end_read strand
     """
     cols = ["contig", f"{fork_type}_start", f"{fork_type}_end", "readID",
             "contig2", "start_read", "end_read", "strand"]
-    df = pd.read_csv(fork_file, sep=r"\s+", header=None, names=cols)
-    df[f"{fork_type}_start"] = df[f"{fork_type}_start"].astype(int)
-    df[f"{fork_type}_end"] = df[f"{fork_type}_end"].astype(int)
+    # Coordinates are parsed as int64 and only narrowed to int32 once they are known to fit
+    coord_cols = [f"{fork_type}_start", f"{fork_type}_end"]
+    df = pd.read_csv(fork_file, sep=r"\s+", header=None, names=cols, engine="c", memory_map=True,
+                     dtype=dict.fromkeys(coord_cols, np.int64))
+    df = downcast_int32(df, coord_cols, fork_file)
 
     # Map strand
     df["strand"] = df["strand"].map({"fwd": "+", "rev": "-"})
@@ -43,97 +72,157 @@ def load_fork_file(fork_file, fork_type):
     return df
 
 
-def assign_fork(row, lf_df, rf_df):
-    ps = row["pauseSite"]
-    readID = row["readID"]
-
-    # Check left forks
-    match_L = lf_df[(lf_df["readID"] == readID) &
-                    (lf_df["lf_start"] <= ps) &
-                    (lf_df["lf_end"] >= ps)]
-    if not match_L.empty:
-        r = match_L.iloc[0]
-        row["direction"] = "L"
-        row["left_fork_start"] = r["lf_start"]
-        row["left_fork_end"] = r["lf_end"]
-        row["strand"] = r["strand"]
-        row["alignLen"] = r["end_read"]
-        row["contig"] = r["contig"]
-        row["start_read"] = r["start_read"]
-        row["end_read"] = r["end_read"]
-        return row
-
-    # Check right forks
-    match_R = rf_df[(rf_df["readID"] == readID) &
-                    (rf_df["rf_start"] <= ps) &
-                    (rf_df["rf_end"] >= ps)]
-    if not match_R.empty:
-        r = match_R.iloc[0]
-        row["direction"] = "R"
-        row["right_fork_start"] = r["rf_start"]
-        row["right_fork_end"] = r["rf_end"]
-        row["strand"] = r["strand"]
-        row["alignLen"] = r["end_read"]
-        row["contig"] = r["contig"]
-        row["start_read"] = r["start_read"]
-        row["end_read"] = r["end_read"]
-        return row
-
-    return row
-
-
-def construct_detect_index(row):
-    """
-    Construct detectIndex:
-    <readID>_<contig>_<start_read>_<end_read>_<strand>_<direction>_<fork_start>_<fork_end>
+def build_fork_index(fork_df, fork_type):
     """
-    fork_start = row["left_fork_start"] if row["direction"] == "L" else row["right_fork_start"]
-    fork_end = row["left_fork_end"] if row["direction"] == "L" else row["right_fork_end"]
+    Flatten forks into arrays sorted by (readID, fork start); the forks of read r
+    occupy [read_offsets[r], read_offsets[r + 1]).
+    Returns: (readIDs, read_offsets, starts, ends, running max of ends per read, fork row positions)
+    """
+    read_codes, read_ids = pd.factorize(fork_df["readID"])
+    starts = fork_df[f"{fork_type}_start"].to_numpy()
+    ends = fork_df[f"{fork_type}_end"].to_numpy()
 
-    return f"{row['readID']}_{row['contig']}_{row['start_read']}_{row['end_read']}_{row['strand']}_{row['direction']}_{fork_start}_{fork_end}"
+    rows = np.lexsort((starts, read_codes))
+    read_codes = read_codes[rows]
+    read_offsets = np.searchsorted(read_codes, np.arange(len(read_ids) + 1))
+    max_ends = pd.Series(ends[rows]).groupby(read_codes).cummax().to_numpy()
 
+    return read_ids, read_offsets, starts[rows], ends[rows], max_ends, rows
+
+
+@njit(parallel=True, cache=True)
+def lookup_forks(read_offsets, starts, ends, max_ends, rows, pause_reads, pause_sites):
+    """
+    For every pause site, return the row position of the first fork (in fork file order)
+    on its read with start <= site <= end, or -1 if no fork contains it.
+    """
+    hits = np.full(len(pause_sites), -1, dtype=np.int64)
+    for k in prange(len(pause_sites)):
+        read = pause_reads[k]
+        if read < 0:
+            continue
+
+        ps = pause_sites[k]
+        lo = read_offsets[read]
+        i = lo + np.searchsorted(starts[lo:read_offsets[read + 1]], ps, side="right")
+        # Forks starting after ps cannot contain it; max_ends rejects the rest in O(1)
+        if i == lo or max_ends[i - 1] < ps:
+            continue
+
+        best = -1
+        for j in range(lo, i):
+            if ends[j] >= ps and (best < 0 or rows[j] < best):
+                best = rows[j]
+        hits[k] = best
+
+    return hits
+
+
+def find_containing_forks(sites, fork_df, fork_type):
+    """
+    For every pause row, find the first fork (in fork file order) on the same read
+    with <fork_type>_start <= pauseSite <= <fork_type>_end.
+    Returns the matching fork rows indexed by the pause row index.
+    """
+    read_ids, read_offsets, starts, ends, max_ends, rows = build_fork_index(fork_df, fork_type)
+    pause_reads = read_ids.get_indexer(sites["readID"])
+
+    fork_rows = lookup_forks(read_offsets, starts, ends, max_ends, rows,
+                             pause_reads, sites["pauseSite"].to_numpy())
+    found = fork_rows >= 0
+
+    hits = fork_df.iloc[fork_rows[found]]
+    hits.index = sites.index[found]
+
+    return hits
 
-def add_non_paused_forks(lf, rf, used_forks, template_columns):
-    rows = []
 
-    for df, start_col, end_col, direction in [
-        (lf, "lf_start", "lf_end", "L"),
-        (rf, "rf_start", "rf_end", "R")
+def assign_forks(pause, lf_df, rf_df):
+    """
+    Fill fork columns of the pause rows, preferring left forks over right forks.
+    """
+    sites = pause[["readID", "pauseSite"]]
+    hits_L = find_containing_forks(sites, lf_df, "lf")
+    hits_R = find_containing_forks(sites, rf_df, "rf")
+    hits_R = hits_R[~hits_R.index.isin(hits_L.index)]
+
+    for hits, direction, fork_cols in [
+        (hits_L, "L", {"left_fork_start": "lf_start", "left_fork_end": "lf_end"}),
+        (hits_R, "R", {"right_fork_start": "rf_start", "right_fork_end": "rf_end"})
     ]:
-        for _, r in df.iterrows():
-            key = (r["readID"], r[start_col], r[end_col], direction)
-            if key in used_forks:
-                continue
+        rows = hits.index
+        pause.loc[rows, "direction"] = direction
+        for col, fork_col in fork_cols.items():
+            pause.loc[rows, col] = hits[fork_col]
+        pause.loc[rows, "strand"] = hits["strand"]
+        pause.loc[rows, "alignLen"] = hits["end_read"]
+        pause.loc[rows, "contig"] = hits["contig"]
+        pause.loc[rows, "start_read"] = hits["start_read"]
+        pause.loc[rows, "end_read"] = hits["end_read"]
+
+    return pause
+
 
-            # Start row with template columns
-            row = {col: "NA" for col in template_columns}
+def construct_detect_index(df):
+    """
+    Construct detectIndex for every row:
+    <readID>_<contig>_<start_read>_<end_read>_<strand>_<direction>_<fork_start>_<fork_end>
+    """
+    is_left = df["direction"] == "L"
+    fork_start = df["left_fork_start"].where(is_left, df["right_fork_start"])
+    fork_end = df["left_fork_end"].where(is_left, df["right_fork_end"])
+    # Strands other than fwd/rev are missing; spell them as the "NA" written to the output
+    strand = df["strand"].fillna("NA")
 
-            # Fill actual fork values
-            row["contig"] = r["contig"]
-            row["strand"] = r["strand"]
-            row["alignLen"] = r["end_read"]
-            row["start_read"] = r["start_read"]
-            row["end_read"] = r["end_read"]
-            if direction == "L":
-                row["left_fork_start"] = r["lf_start"]
-                row["left_fork_end"] = r["lf_end"]
-            else:
-                row["right_fork_start"] = r["rf_start"]
-                row["right_fork_end"] = r["rf_end"]
+    return df["readID"].astype(str).str.cat(
+        [df[col].astype(str) for col in ["contig", "start_read", "end_read"]]
+        + [strand, df["direction"].astype(str), fork_start.astype(str), fork_end.astype(str)],
+        sep="_"
+    )
 
-            row["readID"] = r["readID"]
-            row["direction"] = direction
-            row["keep"] = False
 
-            # Construct detectIndex after all values are filled
-            row["detectIndex"] = construct_detect_index(row)
+def nullable_dtypes(df):
+    """
+    Map the integer and boolean columns of df to pandas nullable dtypes (e.g. int32 -> Int32),
+    so rows missing those values can be concatenated without upcasting to float.
+    """
+    return {
+        col: pd.array(np.empty(0, dtype=dtype)).dtype
+        if isinstance(dtype, np.dtype) and dtype.kind in "iub" else dtype
+        for col, dtype in df.dtypes.items()
+    }
 
-            rows.append(row)
 
-    df_non_paused = pd.DataFrame(rows)
+def add_non_paused_forks(lf, rf, used_forks, template_columns):
+    frames = []
 
-    # Remove temporary readID column
-    df_non_paused.drop(columns=["readID"], inplace=True)
+    for df, start_col, end_col, direction, fork_cols in [
+        (lf, "lf_start", "lf_end", "L", ["left_fork_start", "left_fork_end"]),
+        (rf, "rf_start", "rf_end", "R", ["right_fork_start", "right_fork_end"])
+    ]:
+        keys = pd.MultiIndex.from_arrays([df["readID"], df[start_col], df[end_col], [direction] * len(df)])
+        unused = df[~keys.isin(used_forks)]
+
+        # Fill actual fork values; all other template columns are missing
+        non_paused = pd.DataFrame({
+            "readID": unused["readID"],
+            "contig": unused["contig"],
+            "strand": unused["strand"],
+            "alignLen": unused["end_read"],
+            "start_read": unused["start_read"],
+            "end_read": unused["end_read"],
+            fork_cols[0]: unused[start_col],
+            fork_cols[1]: unused[end_col],
+            "direction": direction,
+            "keep": False,
+        })
+
+        # readID is only kept long enough to build detectIndex
+        non_paused = non_paused.reindex(columns=[*template_columns, "readID"]).astype(FORK_COLUMNS)
+        non_paused["detectIndex"] = construct_detect_index(non_paused)
+        frames.append(non_paused.drop(columns=["readID"]))
+
+    df_non_paused = pd.concat(frames, ignore_index=True)
 
     return df_non_paused
 
@@ -141,50 +230,49 @@ def add_non_paused_forks(lf, rf, used_forks, template_columns):
 def main():
     args = parse_args()
 
-    pause = pd.read_csv(args.pause_file, comment="#", delim_whitespace=True)
-    pause["pauseSite"] = pause["pauseSite"].astype(int)
+    pause = pd.read_csv(args.pause_file, comment="#", sep=r"\s+", engine="c", memory_map=True,
+                        dtype={"pauseSite": np.int64})
+    pause = downcast_int32(pause, ["pauseSite"], args.pause_file)
 
     lf = load_fork_file(args.left_fork_file, "lf")
     rf = load_fork_file(args.right_fork_file, "rf")
 
     # Extract readID from detectIndex
-    pause["readID"] = pause["detectIndex"].apply(lambda x: x.split("_")[0])
-
-    # Initialize fork columns
-    pause["left_fork_start"] = "NA"
-    pause["left_fork_end"] = "NA"
-    pause["right_fork_start"] = "NA"
-    pause["right_fork_end"] = "NA"
-    pause["direction"] = "NA"
-    pause["strand"] = "NA"
-    pause["alignLen"] = "NA"
-    pause["start_read"] = "NA"
-    pause["end_read"] = "NA"
+    pause["readID"] = pause["detectIndex"].str.split("_", n=1).str[0]
+
+    # Initialize fork columns as missing, keeping integer columns numeric
+    for col, dtype in FORK_COLUMNS.items():
+        pause[col] = pd.array([pd.NA] * len(pause), dtype=dtype)
 
     # Assign forks to paused rows
-    pause = pause.apply(assign_fork, axis=1, lf_df=lf, rf_df=rf)
+    pause = assign_forks(pause, lf, rf)
 
-    paused = pause[pause["direction"] != "NA"].copy()
-    paused["detectIndex"] = paused.apply(construct_detect_index, axis=1)
+    paused = pause[pause["direction"].notna()].copy()
+    paused["detectIndex"] = construct_detect_index(paused)
     paused["keep"] = True
 
     # Track used forks
     used_forks = set()
-    for _, r in paused.iterrows():
-        if r["direction"] == "L":
-            used_forks.add((r["readID"], r["left_fork_start"], r["left_fork_end"], "L"))
-        else:
-            used_forks.add((r["readID"], r["right_fork_start"], r["right_fork_end"], "R"))
+    for direction, fork_cols in [("L", ["left_fork_start", "left_fork_end"]),
+                                 ("R", ["right_fork_start", "right_fork_end"])]:
+        arr = paused.loc[paused["direction"] == direction, ["readID"] + fork_cols].to_numpy()
+        used_forks.update(zip(arr[:, 0], arr[:, 1].astype(int), arr[:, 2].astype(int), [direction] * len(arr)))
 
     paused.drop(columns=["readID"], inplace=True)
 
     # Add non-paused forks
     non_paused = add_non_paused_forks(lf, rf, used_forks, paused.columns)
 
+    # Non-paused rows leave the pause file columns missing
+    dtypes = nullable_dtypes(paused)
+    paused = paused.astype(dtypes)
+    non_paused = non_paused.astype({col: dtypes[col] for col in non_paused.columns if non_paused[col].isna().all()})
+
     output = pd.concat([paused, non_paused], ignore_index=True)
 
     # Save to output
-    output.to_csv(args.output_file, sep="\t", index=False)
+    output.to_csv(args.output_file, sep="\t", index=False, na_rep="NA",
+                  chunksize=100_000, lineterminator="\n")
     print(f"Updated pause file saved to: {os.path.abspath(args.output_file)}")
 
 